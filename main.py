@@ -1,9 +1,10 @@
 import argparse
+import logging
 import os
-import yaml
 from project_compression.project_compression import ProjectCompressor
 from project_compression.file_utils import save_chunks_to_files
-from project_compression.token_estimator import estimate_tokens
+from project_compression.token_estimator import count_tokens
+from project_compression.cache_utils import DEFAULT_CACHE_DIR
 
 # create the parser object
 parser = argparse.ArgumentParser(description='Compress a project directory and write it to a text file.')
@@ -13,49 +14,48 @@ parser.add_argument('--project', type=str, help='The path to the project directo
 parser.add_argument('--prefix', type=str, help='The prefix prompt to add to the compressed output.', default="This is compressed text, in your own language. You should be able to decompress it because it's in your language. Here's what to decompress:")
 parser.add_argument('--suffix', type=str, help='The suffix prompt to add to the compressed output.', default="Explain the decompressed content.")
 parser.add_argument('--model', type=str, help='The OpenAI language model to use for compression.', default='gpt-3.5-turbo')
-parser.add_argument('--temperature', type=float, help='The temperature setting to use for the language model.', default=0.4)
+parser.add_argument('--temperature', type=float, help='The temperature setting to use for the language model.', default=0.0)
 parser.add_argument('--config', type=str, help='The path to the configuration file for folders and files to ignore during compression.', default='config.yml')
 parser.add_argument('--max_content_tokens', type=int, help='The maximum number of content tokens allowed for each chunk of compressed data.', default=4000)
-parser.add_argument('--api_key', type=str, help='The OpenAI API key. If not provided, it will be read from the environment variable OPENAI_API_KEY.')
+parser.add_argument('--api_key', type=str, help='The OpenAI API key. If not provided, it will be read from the environment variable named by --api_key_env.')
+parser.add_argument('--api_key_env', type=str, help='The environment variable to read the API key from.', default='OPENAI_API_KEY')
+parser.add_argument('--base_url', type=str, help='The base URL of an OpenAI-compatible API, e.g. a local llama.cpp or vLLM server. If not provided, it will be read from the environment variable OPENAI_BASE_URL, defaulting to the OpenAI API.')
+parser.add_argument('--max_workers', type=int, help='The maximum number of concurrent requests to the OpenAI API.', default=16)
+parser.add_argument('--batch', action='store_true', help='Use the OpenAI Batch API for the compression requests. Cheaper, but results may take up to 24 hours.', default=False)
+parser.add_argument('--cache_dir', type=str, help='The directory in which compressed outputs are cached between runs.', default=DEFAULT_CACHE_DIR)
+parser.add_argument('--no_cache', action='store_true', help='Disable the on-disk cache of compressed outputs.', default=False)
 parser.add_argument('--save', action='store_true', help='Save compressed files to text files.', default=True)
 
+def main():
+    # parse the arguments
+    args = parser.parse_args()
 
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
 
-# parse the arguments
-args = parser.parse_args()
+    # assign arguments to variables
+    project_folderpath = args.project
+    prefix = args.prefix
+    suffix = args.suffix
+    model = args.model
+    temperature = args.temperature
+    config_file_path = args.config
+    max_content_tokens = args.max_content_tokens
 
-# assign arguments to variables
-project_folderpath = args.project
-prefix = args.prefix
-suffix = args.suffix
-model = args.model
-temperature = args.temperature
-config_file_path = args.config
-max_content_tokens = args.max_content_tokens
+    openai_api_key = args.api_key if args.api_key else os.environ.get(args.api_key_env)
+    if not openai_api_key:
+        raise ValueError(f"No OpenAI API key provided or found in the environment variable {args.api_key_env}.")
 
-def read_config_file(config_file_path):
-    with open(config_file_path) as f:
-        config = yaml.safe_load(f)
-    return config
+    # Create the compressor object
+    compressor = ProjectCompressor(model=model, temperature=temperature, max_content_tokens=max_content_tokens, prefix=prefix, suffix=suffix, api_key=openai_api_key, config_file_path=config_file_path, max_workers=args.max_workers, batch=args.batch, cache_dir=None if args.no_cache else args.cache_dir, base_url=args.base_url)
 
-config = read_config_file(config_file_path)
+    compressed_data = compressor.compress_project(project_folderpath)
 
-ignored_folders = config.get('ignored_folders', [])
-ignored_files = config.get('ignored_files', [])
-ignored_extensions = config.get('ignored_extensions', [])
+    total_tokens = sum([count_tokens(chunk, model) for chunk in compressed_data])
+    print(f"Total tokensize of compressed_data: {total_tokens}")
 
-openai_api_key = args.api_key if args.api_key else os.environ.get('OPENAI_API_KEY')
-if not openai_api_key:
-    raise ValueError("No OpenAI API key provided or found in the environment variable OPENAI_API_KEY.")
+    if args.save:
+        num_chunks = save_chunks_to_files(compressed_data)
+        print(f"{num_chunks} chunk(s) saved.")
 
-# Create the compressor object
-compressor = ProjectCompressor(model=model, temperature=temperature, max_content_tokens=max_content_tokens, prefix=prefix, suffix=suffix, api_key=openai_api_key, config_file_path=config_file_path)
-
-compressed_data = compressor.compress_project(project_folderpath)
-
-total_tokens = sum([estimate_tokens(chunk) for chunk in compressed_data])
-print(f"Estimated total tokensize of compressed_data: {total_tokens}")
-
-if args.save:
-    num_chunks = save_chunks_to_files(compressed_data)
-    print(f"{num_chunks} chunk(s) saved.")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
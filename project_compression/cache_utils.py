@@ -0,0 +1,134 @@
+import functools
+import hashlib
+import json
+import os
+import tempfile
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'projectalyzer')
+
+MANIFEST_DIRNAME = 'manifests'
+
+def cache_key(text, model, temperature, base_url, request_fingerprint):
+    """
+    Returns the key under which the compressed version of a text is cached.
+
+    Args:
+    - text: A string representing the text to be compressed.
+    - model: A string representing the name of the OpenAI language model used for compression.
+    - temperature: A float representing the temperature setting used for the language model.
+    - base_url: A string representing the resolved base URL of the API that serves the model, since e.g. a local server may serve a different model under the same name.
+    - request_fingerprint: A string identifying the rest of the request, e.g. the compression prompt and the token bounds.
+
+    Returns:
+    A string representing the hex digest of the SHA-256 hash of the inputs.
+    """
+    return hashlib.sha256(f"{request_fingerprint}\0{base_url}\0{model}\0{temperature}\0{text}".encode('utf-8')).hexdigest()
+
+def read_cache(key, cache_dir):
+    """
+    Returns the cached value for a given key, or None if it is not cached.
+    """
+    try:
+        with open(os.path.join(cache_dir, f"{key}.txt"), 'r', encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def _write_atomic(path, content):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory, delete=False) as f:
+        f.write(content)
+    os.replace(f.name, path)
+
+def write_cache(key, value, cache_dir):
+    """
+    Atomically writes the value for a given key to the cache.
+    """
+    _write_atomic(os.path.join(cache_dir, f"{key}.txt"), value)
+
+def disk_cache(request_fingerprint):
+    """
+    Returns a decorator for functions with the signature (text, model, temperature, base_url, ...) that caches their results on disk.
+
+    The decorated function accepts an additional keyword argument cache_dir. Caching is disabled if it is not given.
+
+    Args:
+    - request_fingerprint: A string identifying the request beyond its arguments, which is part of every cache key.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(text, model, temperature, base_url, *args, cache_dir=None, **kwargs):
+            if not cache_dir:
+                return func(text, model, temperature, base_url, *args, **kwargs)
+
+            key = cache_key(text, model, temperature, base_url, request_fingerprint)
+            cached = read_cache(key, cache_dir)
+            if cached is not None:
+                return cached
+
+            result = func(text, model, temperature, base_url, *args, **kwargs)
+            write_cache(key, result, cache_dir)
+            return result
+
+        return wrapper
+
+    return decorator
+
+class FileManifest:
+    """
+    Remembers the cache key used for each file of a project, so unchanged files can be looked up by their
+    modification time and size without reading and hashing their content.
+
+    Each project root has its own manifest. Only the entries looked up or recorded since it was loaded are saved,
+    so files that were deleted or are ignored now are dropped and the manifest does not grow from run to run.
+    """
+
+    def __init__(self, cache_dir, project_folderpath):
+        project_hash = hashlib.sha256(os.path.abspath(project_folderpath).encode('utf-8')).hexdigest()
+        self.path = os.path.join(cache_dir, MANIFEST_DIRNAME, f"{project_hash}.json")
+        self.cache_dir = cache_dir
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.previous_entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.previous_entries = {}
+        self.entries = {}
+
+    def lookup(self, file_path, file_stat, settings):
+        """
+        Returns a (compressed_content, estimated_tokens) tuple for a file if it is unchanged since it was recorded, otherwise None.
+
+        Args:
+        - file_path: A string representing the path to the file.
+        - file_stat: An os.stat_result of the file.
+        - settings: A dict of the settings that affect the compressed content (model, temperature, size limits, ...).
+          An entry recorded with different settings is not used.
+        """
+        file_path = os.path.abspath(file_path)
+        entry = self.previous_entries.get(file_path)
+        if entry is None:
+            return None
+        if (entry['mtime_ns'], entry['size'], entry.get('settings')) != (file_stat.st_mtime_ns, file_stat.st_size, settings):
+            return None
+        compressed = read_cache(entry['key'], self.cache_dir)
+        if compressed is None:
+            return None
+        # the entry is still in use, so it is kept when the manifest is saved
+        self.entries[file_path] = entry
+        return compressed, entry['tokens']
+
+    def record(self, file_path, file_stat, settings, key, tokens):
+        self.entries[os.path.abspath(file_path)] = {
+            'mtime_ns': file_stat.st_mtime_ns,
+            'size': file_stat.st_size,
+            'settings': settings,
+            'key': key,
+            'tokens': tokens,
+        }
+
+    def save(self):
+        """
+        Atomically writes the entries looked up or recorded since the manifest was loaded, dropping all others.
+        """
+        _write_atomic(self.path, json.dumps(self.entries))
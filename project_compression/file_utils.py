@@ -1,5 +1,19 @@
+import codecs
+import fnmatch
+import functools
+import os
+import re
 from project_compression.token_estimator import estimate_tokens
 
+# number of bytes at the start of a file that are inspected to decide whether it is binary
+SNIFF_BYTES = 8 * 1024
+
+# files larger than this are not read at all
+MAX_FILE_BYTES = 512 * 1024
+
+# bytes that commonly occur in text files: printable ASCII, all bytes >= 0x80 and a few control characters
+TEXT_BYTES = bytes({7, 8, 9, 10, 12, 13, 27} | set(range(0x20, 0x100)) - {0x7f})
+
 def read_file_content(file_path, encoding='utf-8'):
     """
     Reads the content of a file and returns it as a string.
@@ -15,8 +29,129 @@ def read_file_content(file_path, encoding='utf-8'):
         content = f.read()
     return content
 
+@functools.lru_cache(maxsize=None)
+def compile_ignore_patterns(patterns):
+    """
+    Compiles glob patterns (e.g. '*.egg-info' or 'build') into a single regular expression, so a name is matched
+    against all of them in one pass instead of one fnmatch call per pattern.
+
+    Args:
+    - patterns: A tuple of strings representing the glob patterns.
+
+    Returns:
+    A function that takes a name and returns a truthy value if it matches any of the patterns.
+    """
+    if not patterns:
+        return lambda name: None
+    return re.compile('|'.join(fnmatch.translate(pattern) for pattern in patterns)).match
+
+@functools.lru_cache(maxsize=None)
+def compile_ignored_extensions(extensions):
+    """
+    Builds a matcher for file names that end with any of the given extensions, ignoring case.
+
+    Args:
+    - extensions: A tuple of strings representing the file extensions (e.g. '.png' or '.tar.gz').
+
+    Returns:
+    A function that takes a name and returns True if it ends with any of the extensions.
+    """
+    extensions = tuple(ext.lower() for ext in extensions)
+    if not extensions:
+        return lambda name: False
+    return lambda name: name.lower().endswith(extensions)
+
+def is_binary(data, max_non_text_ratio=0.3):
+    """
+    Guesses whether the given bytes, typically the start of a file, are binary rather than UTF-8 text.
+
+    Args:
+    - data: A bytes object representing the data to inspect.
+    - max_non_text_ratio: A float representing the largest ratio of non-text bytes still accepted as text.
+
+    Returns:
+    A boolean, True if the data contains NUL bytes, is not valid UTF-8 or has too many non-text bytes.
+    """
+    if not data:
+        return False
+    if b'\x00' in data:
+        return True
+    try:
+        # an incremental decoder tolerates a multi-byte character cut off at the end of the data
+        codecs.getincrementaldecoder('utf-8')().decode(data)
+    except UnicodeDecodeError:
+        return True
+    return len(data.translate(None, TEXT_BYTES)) / len(data) > max_non_text_ratio
+
+def read_text_file(file_path, encoding='utf-8'):
+    """
+    Reads the content of a file if it is a text file.
+
+    Args:
+    - file_path: A string representing the path to the file.
+    - encoding: A string representing the encoding to use when decoding the file. Defaults to 'utf-8'.
+
+    Returns:
+    A string representing the content of the file, or None if the file is binary.
+    """
+    with open(file_path, 'rb') as f:
+        # only the start of a file is read to detect binaries, so the rest of a large binary is never read
+        data = f.read(SNIFF_BYTES)
+        if is_binary(data):
+            return None
+        data += f.read()
+    try:
+        return data.decode(encoding)
+    except UnicodeDecodeError:
+        return None
+
+def walk_project_files(folder_path, ignored_folders=[], ignored_files=[], ignored_extensions=[]):
+    """
+    Yields the files below a given directory path, walking it depth-first with os.scandir.
+
+    Args:
+    - folder_path: A string representing the path to the directory.
+    - ignored_folders: A list of folder names or glob patterns to ignore. Ignored folders are not descended into.
+    - ignored_files: A list of file names or glob patterns to ignore.
+    - ignored_extensions: A list of file extensions to ignore (case-insensitive).
+
+    Returns:
+    An iterator of os.DirEntry objects, one per file, in sorted order within each directory.
+    """
+    is_ignored_folder = compile_ignore_patterns(tuple(ignored_folders))
+    is_ignored_file = compile_ignore_patterns(tuple(ignored_files))
+    has_ignored_extension = compile_ignored_extensions(tuple(ignored_extensions))
+
+    stack = [folder_path]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+        subfolders = []
+        for entry in entries:
+            # filter by name first, so ignored entries cost no further syscalls
+            if entry.is_file():
+                if is_ignored_file(entry.name) or has_ignored_extension(entry.name):
+                    continue
+                yield entry
+            # symlinked folders are not followed, like os.walk, so links to a parent folder cannot loop
+            elif entry.is_dir(follow_symlinks=False):
+                if is_ignored_folder(entry.name):
+                    continue
+                subfolders.append(entry.path)
+        # reversed so the subfolders are popped in sorted order
+        stack.extend(reversed(subfolders))
+
 def save_chunks_to_files(compressed_data, base_filename='compressed_project_chunk'):
-    
+    """
+    Writes each chunk of compressed data to its own text file.
+
+    Args:
+    - compressed_data: A list of strings representing the chunks.
+    - base_filename: A string representing the filename prefix. The chunk index and '.txt' are appended to it.
+
+    Returns:
+    An integer representing the number of chunks written.
+    """
     for i, chunk in enumerate(compressed_data):
         with open(f"{base_filename}_{i}.txt", "w") as f:
             f.write(chunk)
@@ -1,41 +1,248 @@
-import openai
+import hashlib
+import json
 import os
+import random
+import threading
+import time
 
 from dotenv import load_dotenv
+from .cache_utils import disk_cache
+from .token_estimator import count_tokens
 
 load_dotenv()
 
-def compress_string(text, model, temperature, api_key=None):
+MAX_RETRIES = 8
+MIN_RETRY_WAIT = 1
+MAX_RETRY_WAIT = 60
+
+COMPRESSION_PROMPT = "Compress the following text as much as possible in a way that you the LLM can reconstruct exactly 100% the original text. This is for yourself. It does not need to be human readable or understandable. Abuse of language mixing, abbreviations, symbols (unicode and emoji), or any other encodings or internal representations is all permissible, as long as it, if pasted in a new inference cycle, will yield exactly- 100% identical results as the original text. This should be a lossless compression."
+
+# lower bound for the max_tokens of a compression request, so short texts are not cut off
+MIN_MAX_TOKENS = 256
+
+# upper bound for the max_tokens of a compression request, the most output tokens gpt-3.5-turbo and gpt-4-turbo accept
+MAX_MAX_TOKENS = 4096
+
+COMPRESSION_SEED = 0
+
+# version of the layout of build_compression_request. bump it whenever the request changes in a way that
+# REQUEST_FINGERPRINT does not already cover, e.g. when messages are added or reordered
+REQUEST_FORMAT_VERSION = 1
+
+# identifies everything about a compression request besides the text, model, temperature and base URL. it is part of
+# every cache key, so cached outputs of an earlier prompt or earlier token bounds are not served after they change
+REQUEST_FINGERPRINT = hashlib.sha256(json.dumps([REQUEST_FORMAT_VERSION, COMPRESSION_PROMPT, MIN_MAX_TOKENS, MAX_MAX_TOKENS, COMPRESSION_SEED]).encode('utf-8')).hexdigest()
+
+BATCH_TERMINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+
+# clients are shared per API key and base URL, so their connection pools are reused across calls and threads
+_clients = {}
+_clients_lock = threading.Lock()
+
+# openai is imported lazily inside the functions that call the API, so importing this module, e.g. for
+# COMPRESSION_PROMPT or on code paths that are served from the cache, does not pay for importing the SDK
+
+class CompressionTruncatedError(ValueError):
+    """
+    Raised when the compressed text was cut off at max_tokens, e.g. because the model kept repeating itself.
+    """
+
+def _retryable_errors():
+    """
+    Returns the exception types after which the same request may succeed when sent again.
+    """
+    import openai
+
+    return (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+def get_api_key(api_key=None):
+    """
+    Returns the OpenAI API key to use for authentication.
+
+    Args:
+    - api_key: A string representing the OpenAI API key (optional). If not provided, it is read from the environment variable OPENAI_API_KEY.
+
+    Returns:
+    A string representing the OpenAI API key.
+    """
+    if api_key is None:
+        api_key = os.environ.get("OPENAI_API_KEY")
+
+    if api_key is None:
+        raise ValueError("API key not provided or found in environment variables.")
+
+    return api_key
+
+def resolve_base_url(base_url=None, client=None):
+    """
+    Returns the base URL that requests are sent to, e.g. to tell cached results of different servers apart.
+
+    Args:
+    - base_url: A string representing the base URL of an OpenAI-compatible API (optional). If not provided, it is read from the environment variable OPENAI_BASE_URL, defaulting to the OpenAI API.
+    - client: An openai.OpenAI client (optional). If given, its base URL is returned instead.
+
+    Returns:
+    A string representing the base URL without a trailing slash.
+    """
+    if client is not None:
+        base_url = str(client.base_url)
+    else:
+        base_url = base_url or os.environ.get("OPENAI_BASE_URL", DEFAULT_BASE_URL)
+    return base_url.rstrip('/')
+
+def get_client(api_key=None, base_url=None):
+    """
+    Returns the shared OpenAI client for a given API key and base URL, creating it on first use.
+
+    Args:
+    - api_key: A string representing the OpenAI API key (optional). If not provided, it is read from the environment variable OPENAI_API_KEY.
+    - base_url: A string representing the base URL of an OpenAI-compatible API, e.g. a local llama.cpp or vLLM server (optional). If not provided, it is read from the environment variable OPENAI_BASE_URL, defaulting to the OpenAI API.
+
+    Returns:
+    An openai.OpenAI client.
+    """
+    import openai
+
+    api_key = get_api_key(api_key)
+    base_url = resolve_base_url(base_url)
+
+    with _clients_lock:
+        client = _clients.get((api_key, base_url))
+        if client is None:
+            # retries are handled by compress_string, so the client does not retry on its own
+            client = _clients[(api_key, base_url)] = openai.OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+    return client
+
+def build_compression_request(text, model, temperature):
+    """
+    Builds the chat completion parameters used to compress a given string.
+
+    The prompt is sent as an identical system message in every request, so the server can reuse its cached prefix.
+    The output is capped at twice the text's token count, at least MIN_MAX_TOKENS and at most MAX_MAX_TOKENS.
+
+    Args:
+    - text: A string representing the text to be compressed.
+    - model: A string representing the name of the OpenAI language model to use for compression.
+    - temperature: A float representing the temperature setting to use for the language model.
+
+    Returns:
+    A dict with the parameters for a chat completion request.
+    """
+    return {
+        'model': model,
+        'messages': [
+            {'role': 'system', 'content': COMPRESSION_PROMPT},
+            {'role': 'user', 'content': text}
+        ],
+        'temperature': temperature,
+        'max_tokens': min(MAX_MAX_TOKENS, max(MIN_MAX_TOKENS, 2 * count_tokens(text, model))),
+        'seed': COMPRESSION_SEED,
+    }
+
+def compress_string(text, model, temperature, api_key=None, client=None, base_url=None, cache_dir=None):
     """
     Compresses a given string using OpenAI's language model.
 
+    If cache_dir is given, results are cached on disk in that directory, keyed by the text, model, temperature, base URL and REQUEST_FINGERPRINT.
+
     Args:
     - text: A string representing the text to be compressed.
     - model: A string representing the name of the OpenAI language model to use for compression.
     - temperature: A float representing the temperature setting to use for the language model.
     - api_key: A string representing the OpenAI API key to use for authentication (optional).
+    - client: An openai.OpenAI client to send the request with (optional). Defaults to the shared client for the API key and base URL.
+    - base_url: A string representing the base URL of an OpenAI-compatible API (optional). Only used if no client is given.
+    - cache_dir: A string representing the directory of the disk cache (optional). Caching is disabled if it is not given.
 
     Returns:
     A string representing the compressed version of the input text.
+
+    Raises:
+    CompressionTruncatedError: If the compressed text was cut off at max_tokens. It is not returned, so it is not cached either.
     """
+    return _compress_string(text, model, temperature, resolve_base_url(base_url, client), api_key, client, cache_dir=cache_dir)
 
-    prompt = "Compress the following text as much as possible in a way that you the LLM can reconstruct exactly 100% the original text. This is for yourself. It does not need to be human readable or understandable. Abuse of language mixing, abbreviations, symbols (unicode and emoji), or any other encodings or internal representations is all permissible, as long as it, if pasted in a new inference cycle, will yield exactly- 100% identical results as the original text. This should be a lossless compression."
+@disk_cache(REQUEST_FINGERPRINT)
+def _compress_string(text, model, temperature, base_url, api_key, client):
+    if client is None:
+        client = get_client(api_key, base_url)
+    retryable_errors = _retryable_errors()
 
-    if api_key is None:
-        api_key = os.environ.get("OPENAI_API_KEY")
+    # back off exponentially with random jitter on rate limits and transient server errors, which are likely
+    # when many files are compressed concurrently. the jitter keeps the workers from retrying in lockstep
+    for attempt in range(MAX_RETRIES):
+        try:
+            response = client.chat.completions.create(**build_compression_request(text, model, temperature))
+            break
+        except retryable_errors:
+            if attempt == MAX_RETRIES - 1:
+                raise
+            time.sleep(random.uniform(MIN_RETRY_WAIT, min(MAX_RETRY_WAIT, MIN_RETRY_WAIT * 2 ** attempt)))
 
-    if api_key is None:
-        raise ValueError("API key not provided or found in environment variables.")
+    choice = response.choices[0]
+    if choice.finish_reason == 'length':
+        raise CompressionTruncatedError("The compressed text was cut off at max_tokens.")
+    return choice.message.content
 
-    openai.api_key = api_key
+def compress_strings_batch(texts, model, temperature, api_key=None, poll_interval=30, client=None, base_url=None):
+    """
+    Compresses multiple strings with a single request to OpenAI's Batch API.
 
-    response = openai.ChatCompletion.create(
-        model=model,
-        messages=[
-            {'role': 'user', 'content': prompt + text}
-        ],
-        temperature=temperature,
-    )
+    Batch requests are billed at a lower price than individual requests, but results may take up to 24 hours to arrive.
+
+    Args:
+    - texts: A dict mapping a unique identifier (e.g. a file path) to the text to be compressed.
+    - model: A string representing the name of the OpenAI language model to use for compression.
+    - temperature: A float representing the temperature setting to use for the language model.
+    - api_key: A string representing the OpenAI API key to use for authentication (optional).
+    - poll_interval: A number representing the seconds to wait between status checks of the batch.
+    - client: An openai.OpenAI client to send the requests with (optional). Defaults to the shared client for the API key and base URL.
+    - base_url: A string representing the base URL of an OpenAI-compatible API (optional). Only used if no client is given.
+
+    Returns:
+    A dict mapping each identifier to the compressed version of its text, or to None if the compressed text was cut off at max_tokens.
+    Identifiers whose request failed are left out.
+    """
+    if not texts:
+        return {}
+
+    if client is None:
+        client = get_client(api_key, base_url)
+
+    batch_lines = []
+    for custom_id, text in texts.items():
+        line = {
+            'custom_id': custom_id,
+            'method': 'POST',
+            'url': '/v1/chat/completions',
+            'body': build_compression_request(text, model, temperature),
+        }
+        batch_lines.append(json.dumps(line) + '\n')
+
+    input_file = client.files.create(file=('batch_input.jsonl', ''.join(batch_lines).encode('utf-8')), purpose='batch')
+    batch = client.batches.create(input_file_id=input_file.id, endpoint='/v1/chat/completions', completion_window='24h')
+
+    while batch.status not in BATCH_TERMINAL_STATUSES:
+        time.sleep(poll_interval)
+        batch = client.batches.retrieve(batch.id)
+
+    # a batch in which every request failed has no output file. all identifiers are then left out, so the caller can retry them
+    if not batch.output_file_id:
+        return {}
 
-    return response['choices'][0]['message']['content']
+    compressed_texts = {}
+    output = client.files.content(batch.output_file_id).text
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        response = result.get('response')
+        if result.get('error') or not response or response.get('status_code') != 200:
+            continue
+        choice = response['body']['choices'][0]
+        # a cut off output is not left out, as sending the same request again would most likely be cut off as well
+        compressed_texts[result['custom_id']] = None if choice.get('finish_reason') == 'length' else choice['message']['content']
 
+    return compressed_texts
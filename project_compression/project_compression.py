@@ -1,13 +1,47 @@
-import openai
+import logging
 import os
+import threading
 import yaml
-from .openai_utils import compress_string
-from .token_estimator import estimate_tokens
-from .file_utils import read_file_content
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+from .openai_utils import REQUEST_FINGERPRINT, CompressionTruncatedError, compress_string, compress_strings_batch, resolve_base_url
+from .cache_utils import FileManifest, cache_key, read_cache, write_cache
+from .token_estimator import count_tokens
+from .file_utils import MAX_FILE_BYTES, read_text_file, walk_project_files
 from .prompt_utils import add_prefix_prompt, get_folder_structure
 
+# the libyaml based loader is much faster, but only available if PyYAML was built with libyaml
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+logger = logging.getLogger(__name__)
+
+# identifier of the folder structure among the texts to compress, which are otherwise keyed by file path
+FOLDER_STRUCTURE_ID = '<folder_structure>'
+
+def group_ids_by_text(texts):
+    """
+    Groups the identifiers of the given texts by their text, so that duplicate texts (e.g. empty __init__.py files) are compressed only once.
+
+    Args:
+    - texts: A dict mapping an identifier to a text.
+
+    Returns:
+    A dict mapping each distinct text to the list of its identifiers, in their original order.
+    """
+    text_ids = {}
+    for text_id, text in texts.items():
+        text_ids.setdefault(text, []).append(text_id)
+    return text_ids
+
+FILE_TOO_LARGE_CONTENT = "COMPRESSION OUTPUT: FILE TOO LARGE TO BE ANALYSED. ASK FOR MORE INFORMATION WHEN CONTENT OF FILE IS NEEDED."
+
+COMPRESSION_TRUNCATED_CONTENT = "COMPRESSION OUTPUT: COMPRESSION OF FILE WAS CUT OFF. ASK FOR MORE INFORMATION WHEN CONTENT OF FILE IS NEEDED."
+
 class ProjectCompressor:
-    def __init__(self, model='gpt-3.5-turbo', temperature=0.7, max_content_tokens=4000, prefix="", suffix="", config_file_path=None, api_key=None):
+    def __init__(self, model='gpt-3.5-turbo', temperature=0.0, max_content_tokens=4000, prefix="", suffix="", config_file_path=None, api_key=None, max_workers=16, io_workers=32, max_pending_files=64, max_file_bytes=MAX_FILE_BYTES, batch=False, batch_poll_interval=30, cache_dir=None, client=None, base_url=None):
         self.model = model
         self.temperature = temperature
         self.max_content_tokens = max_content_tokens
@@ -15,6 +49,17 @@ class ProjectCompressor:
         self.suffix = suffix
         self.config_file_path = config_file_path
         self.api_key = api_key
+        self.max_workers = max_workers
+        self.io_workers = io_workers
+        self.max_pending_files = max_pending_files
+        self.max_file_bytes = max_file_bytes
+        self.batch = batch
+        self.batch_poll_interval = batch_poll_interval
+        self.cache_dir = cache_dir
+        self.client = client
+        self.base_url = base_url
+        # the base URL the requests actually go to, which is part of every cache key
+        self.resolved_base_url = resolve_base_url(base_url, client)
 
         if self.api_key:
             os.environ["OPENAI_API_KEY"] = self.api_key
@@ -24,75 +69,303 @@ class ProjectCompressor:
             return {'ignored_folders': [], 'ignored_files': [], 'ignored_extensions': []}
 
         with open(self.config_file_path) as f:
-            config = yaml.safe_load(f)
+            config = yaml.load(f, Loader=SafeLoader)
         return config
 
+    def text_cache_key(self, text):
+        """
+        Returns the key under which the compressed version of a text is cached with the compressor's settings.
+        """
+        return cache_key(text, self.model, self.temperature, self.resolved_base_url, REQUEST_FINGERPRINT)
+
+    def compression_result(self, future, text_id):
+        """
+        Returns the compressed text of a finished compression, or the COMPRESSION_TRUNCATED_CONTENT placeholder if it was cut off.
+
+        Args:
+        - future: A concurrent.futures.Future of a compress_string call.
+        - text_id: A string representing the identifier (e.g. the file path) of the compressed text, used in the warning.
+        """
+        try:
+            return future.result()
+        except CompressionTruncatedError:
+            # e.g. a model repeating itself until max_tokens. the placeholder is not cached, so the file is tried again next run
+            logger.warning("The compression of %s was cut off. Its content is ignored.", text_id)
+            return COMPRESSION_TRUNCATED_CONTENT
+
+    def compress_texts_parallel(self, texts):
+        compressed_results = {}
+        text_ids = group_ids_by_text(texts)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor, tqdm(total=len(texts), desc="compressing", unit="file") as progress:
+            futures = {
+                executor.submit(compress_string, text, self.model, self.temperature, self.api_key, client=self.client, base_url=self.base_url, cache_dir=self.cache_dir): text
+                for text in text_ids
+            }
+            for future in as_completed(futures):
+                for text_id in text_ids[futures[future]]:
+                    compressed_results[text_id] = self.compression_result(future, text_id)
+                progress.update(len(text_ids[futures[future]]))
+
+        return compressed_results
+
+    def compress_texts_batch(self, texts):
+        cached_results = {}
+        if self.cache_dir:
+            for text_id, text in texts.items():
+                cached = read_cache(self.text_cache_key(text), self.cache_dir)
+                if cached is not None:
+                    cached_results[text_id] = cached
+            texts = {text_id: text for text_id, text in texts.items() if text_id not in cached_results}
+        if not texts:
+            return cached_results
+
+        # identical texts are only sent once and their result is shared by all identifiers
+        text_ids = group_ids_by_text(texts)
+        unique_texts = {ids[0]: text for text, ids in text_ids.items()}
+        print(f"Submitting {len(unique_texts)} compression requests to the OpenAI Batch API...")
+        unique_results = compress_strings_batch(unique_texts, self.model, self.temperature, self.api_key, poll_interval=self.batch_poll_interval, client=self.client, base_url=self.base_url)
+        compressed_results = {
+            text_id: unique_results[ids[0]]
+            for ids in text_ids.values() if ids[0] in unique_results
+            for text_id in ids
+        }
+
+        for text_id, compressed in compressed_results.items():
+            if compressed is None:
+                logger.warning("The compression of %s was cut off. Its content is ignored.", text_id)
+                compressed_results[text_id] = COMPRESSION_TRUNCATED_CONTENT
+
+        # requests that failed inside the batch are retried individually
+        missing = {text_id: text for text_id, text in texts.items() if text_id not in compressed_results}
+        if missing:
+            print(f"{len(missing)} batch request(s) failed. Retrying them individually...")
+            compressed_results.update(self.compress_texts_parallel(missing))
+
+        if self.cache_dir:
+            for text_id, compressed in compressed_results.items():
+                if compressed == COMPRESSION_TRUNCATED_CONTENT:
+                    continue
+                write_cache(self.text_cache_key(texts[text_id]), compressed, self.cache_dir)
+
+        compressed_results.update(cached_results)
+        return compressed_results
+
+    def build_chunks(self, comp_folder_structure, compressed_files):
+        """
+        Distributes the compressed files over prompt chunks of at most max_content_tokens tokens each.
+
+        Args:
+        - comp_folder_structure: A string representing the compressed folder structure, repeated in every chunk.
+        - compressed_files: A list of (file_path, estimated_tokens, compressed_content) tuples in output order.
+
+        Returns:
+        A list of strings representing the chunks.
+        """
+        header = f"{self.prefix}\nThis is the compressed folder and file structure of the project: {comp_folder_structure}\n"
+        base_tokens = count_tokens(header, self.model) + count_tokens(self.suffix, self.model)
+
+        chunk_lines = []
+        current_lines = []
+        current_tokens = base_tokens
+        for file_path, file_tokens, comp_content in compressed_files:
+            line = f"This is the compressed content of {file_path} with an estimated decompressed token length of {file_tokens}: {comp_content}\n"
+            line_tokens = count_tokens(line, self.model)
+            if current_lines and current_tokens + line_tokens > self.max_content_tokens:
+                chunk_lines.append(current_lines)
+                current_lines = []
+                current_tokens = base_tokens
+            current_lines.append(line)
+            current_tokens += line_tokens
+
+        if current_lines or not chunk_lines:
+            chunk_lines.append(current_lines)
+
+        # each chunk is assembled with a single join instead of chained concatenations of the growing body
+        return [
+            ''.join([f"THIS IS PART {i} OF {len(chunk_lines)}.\n", header, *lines, self.suffix])
+            for i, lines in enumerate(chunk_lines)
+        ]
+
+    def manifest_settings(self):
+        """
+        Returns the settings a cached file entry must have been recorded with to be reused. Besides the model, the API
+        serving it and the request format, they include the limits that decide whether a file is replaced by the
+        FILE_TOO_LARGE_CONTENT placeholder.
+        """
+        return {
+            'request': REQUEST_FINGERPRINT,
+            'base_url': self.resolved_base_url,
+            'model': self.model,
+            'temperature': self.temperature,
+            'max_content_tokens': self.max_content_tokens,
+            'max_file_bytes': self.max_file_bytes,
+        }
+
+    def read_project_file(self, file_path, file_stat):
+        """
+        Reads a project file and prepares the text to compress for it.
+
+        Args:
+        - file_path: A string representing the path to the file.
+        - file_stat: An os.stat_result of the file.
+
+        Returns:
+        A (text, estimated_tokens) tuple, or None if the file is binary. Files too large to be analysed get a placeholder text.
+        """
+        if file_stat.st_size > self.max_file_bytes:
+            # too large to be analysed anyway, so the file is not read. its token length is estimated from its size
+            logger.warning("%s is too large to be analysed. Its content is ignored.", file_path)
+            return FILE_TOO_LARGE_CONTENT, file_stat.st_size // 4
+
+        content = read_text_file(file_path)
+        if content is None:
+            # binary files would only waste tokens
+            return None
+
+        file_tokens = count_tokens(content, self.model)
+        if file_tokens > self.max_content_tokens:
+            logger.warning("%s has too many tokens to be analysed. Its content is ignored.", file_path)
+            return FILE_TOO_LARGE_CONTENT, file_tokens
+
+        return content, file_tokens
+
     def compress_project(self, project_folderpath):
         print(f"Compressing project at {project_folderpath}...")
-        folder_structure = get_folder_structure(project_folderpath, **self.read_config_file())
+        config = self.read_config_file()
+        folder_structure = get_folder_structure(project_folderpath, **config)
 
         print(folder_structure)
 
-        estimated_tokens = estimate_tokens(folder_structure)
+        estimated_tokens = count_tokens(folder_structure, self.model)
         print(f"ESTIMATED TOKEN LENGTH: {estimated_tokens}")
 
-        if estimated_tokens > self.max_content_tokens:
-            comp_folder_structure = "AMOUNT OF PATHS AND FILES TOO MANY TO BE ANALYSED. ASK FOR MORE INFORMATION WHEN FOLDERSTRUCTURE IS NEEDED."
-            print("FOLDER STRUCTURE TOO LARGE TO BE ANALYSED. ASK FOR MORE INFORMATION WHEN NEEDED.")
+        manifest = FileManifest(self.cache_dir, project_folderpath) if self.cache_dir else None
+        manifest_settings = self.manifest_settings()
 
-        else:
-            comp_folder_structure = compress_string(folder_structure, self.model, self.temperature, self.api_key)
-            print("Folder structure compressed successfully!")
+        # files are read by one thread pool and, unless the batch API is used, handed straight to a second pool for the
+        # API calls, so disk and network are busy at the same time. at most max_pending_files files are read but not yet
+        # compressed, and only the cache key of a file is kept once it is submitted, which keeps large projects from
+        # being loaded into memory as a whole
+        pending_files = threading.BoundedSemaphore(self.max_pending_files)
+        compressions = {}
+        compressions_lock = threading.Lock()
+
+        def submit_compression(text):
+            # identical texts share one API call. they are told apart by their cache key, so the texts are not kept
+            key = self.text_cache_key(text)
+            with compressions_lock:
+                future = compressions.get(key)
+                if future is None:
+                    future = compressions[key] = api_executor.submit(compress_string, text, self.model, self.temperature, self.api_key, client=self.client, base_url=self.base_url, cache_dir=self.cache_dir)
+            return key, future
+
+        def file_done(_=None):
+            pending_files.release()
+            progress.update(1)
+
+        def read_and_submit(file_path, file_stat):
+            try:
+                prepared = self.read_project_file(file_path, file_stat)
+            except BaseException:
+                file_done()
+                raise
+            if prepared is None:
+                file_done()
+                return None
+            content, file_tokens = prepared
+            key, future = submit_compression(content)
+            future.add_done_callback(file_done)
+            return file_tokens, key, future
+
+        file_stats = {}
+        compressed_results = {}
+        # (file_path, cache_key, estimated_tokens) of every file in walk order
+        file_keys = []
+        # the batch API needs all texts at once, so only then are the contents kept
+        batch_texts = {}
+        # the total is only known once the walk is done. tqdm's update is thread-safe, so the workers report progress themselves
+        progress = tqdm(desc="compressing", unit="file", disable=self.batch)
+        with progress, ThreadPoolExecutor(max_workers=self.io_workers) as io_executor, ThreadPoolExecutor(max_workers=self.max_workers) as api_executor:
+            if estimated_tokens > self.max_content_tokens:
+                folder_future = None
+                comp_folder_structure = "AMOUNT OF PATHS AND FILES TOO MANY TO BE ANALYSED. ASK FOR MORE INFORMATION WHEN FOLDERSTRUCTURE IS NEEDED."
+                print("FOLDER STRUCTURE TOO LARGE TO BE ANALYSED. ASK FOR MORE INFORMATION WHEN NEEDED.")
+            elif self.batch:
+                folder_future = None
+            else:
+                folder_future = submit_compression(folder_structure)[1]
+
+            pending_reads = []
+            for entry in walk_project_files(project_folderpath, **config):
+                file_path = entry.path
+                file_stat = entry.stat()
+                if file_stat.st_size == 0:
+                    continue
 
-        compressed_content = {}
-        for root, dirs, files in os.walk(project_folderpath):
-            for file in files:
-                file_path = os.path.join(root, file)
-                file_ext = os.path.splitext(file_path)[1]
-                if file_ext in self.read_config_file().get('ignored_extensions', []):
+                if manifest is not None:
+                    cached = manifest.lookup(file_path, file_stat, manifest_settings)
+                    if cached is not None:
+                        compressed_results[file_path], file_tokens = cached
+                        pending_reads.append((file_path, None, file_tokens))
+                        continue
+                    file_stats[file_path] = file_stat
+
+                if self.batch:
+                    read_future = io_executor.submit(self.read_project_file, file_path, file_stat)
+                else:
+                    pending_files.acquire()
+                    read_future = io_executor.submit(read_and_submit, file_path, file_stat)
+                pending_reads.append((file_path, read_future, None))
+
+            progress.total = sum(read_future is not None for _, read_future, _ in pending_reads)
+            progress.refresh()
+
+            # results are collected in walk order, so the output does not depend on completion order
+            for file_path, read_future, file_tokens in pending_reads:
+                if read_future is None:
+                    file_keys.append((file_path, None, file_tokens))
                     continue
-                if any(ignored_file in file_path for ignored_file in self.read_config_file().get('ignored_files', [])):
+
+                prepared = read_future.result()
+                if prepared is None:
+                    file_stats.pop(file_path, None)
                     continue
-                if any(ignored_folder in file_path for ignored_folder in self.read_config_file().get('ignored_folders', [])):
+
+                if self.batch:
+                    content, file_tokens = prepared
+                    batch_texts[file_path] = content
+                    file_keys.append((file_path, self.text_cache_key(content), file_tokens))
                     continue
 
-                content = read_file_content(file_path)
-                estimated_tokens = estimate_tokens(content)
-
-                if estimated_tokens > self.max_content_tokens:
-                    content = "COMPRESSION OUTPUT: FILE TOO LARGE TO BE ANALYSED. ASK FOR MORE INFORMATION WHEN CONTENT OF FILE IS NEEDED."
-                    print("FILE TOO MANY TOKEN TO BE ANALYSED. IGNORED.")
-
-                comp_content = compress_string(content, self.model, self.temperature, self.api_key)
-                compressed_content[file_path] = comp_content
-                print(f"ESTIMATED TOKEN LENGTH: {estimated_tokens}")
-                print(f"{file_path} compressed successfully!")
-                
-        prompt_template = f"This is the compressed folder and file structure of the project: {comp_folder_structure}\n"
-
-        chunks = []
-        current_chunk = ''
-        for file_path, comp_content in compressed_content.items():
-            estimated_tokens = estimate_tokens(read_file_content(file_path))
-            line = f"This is the compressed content of {file_path} with an estimated decompressed token length of {estimated_tokens}: {comp_content}\n"
-            tmp_chunk = self.prefix +"\n"+ prompt_template + current_chunk + line + self.suffix
-            if estimate_tokens(tmp_chunk) > self.max_content_tokens:
-                chunks.append(tmp_chunk)
-                current_chunk = ''
-
-            current_chunk += line
-        
-        if current_chunk:
-            final_chunk = self.prefix +"\n"+ prompt_template + current_chunk + line + self.suffix
-            chunks.append(final_chunk)
-
-        for i, chunk in enumerate(chunks):
-            page_string = f"THIS IS PART {i} OF {len(chunks)}.\n"
-            if isinstance(chunk, tuple):
-                chunk = chunk[0]
-            chunks[i] = page_string + chunk
+                file_tokens, key, future = prepared
+                file_keys.append((file_path, key, file_tokens))
+                try:
+                    compressed_results[file_path] = self.compression_result(future, file_path)
+                except Exception:
+                    logger.error("Compressing %s failed.", file_path)
+                    raise
+
+            if folder_future is not None:
+                compressed_results[FOLDER_STRUCTURE_ID] = self.compression_result(folder_future, "the folder structure")
+
+        if self.batch:
+            if estimated_tokens <= self.max_content_tokens:
+                batch_texts[FOLDER_STRUCTURE_ID] = folder_structure
+            compressed_results.update(self.compress_texts_batch(batch_texts))
+
+        if manifest is not None:
+            for file_path, key, file_tokens in file_keys:
+                if file_path in file_stats:
+                    manifest.record(file_path, file_stats[file_path], manifest_settings, key, file_tokens)
+            manifest.save()
+
+        if FOLDER_STRUCTURE_ID in compressed_results:
+            comp_folder_structure = compressed_results[FOLDER_STRUCTURE_ID]
+            print("Folder structure compressed successfully!")
+
+        compressed_files = [(file_path, file_tokens, compressed_results[file_path]) for file_path, _, file_tokens in file_keys]
+        chunks = self.build_chunks(comp_folder_structure, compressed_files)
 
         print("Project compressed successfully!")
-                
-        return chunks
 
+        return chunks
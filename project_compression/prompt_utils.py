@@ -1,6 +1,7 @@
 import os
-from project_compression.token_estimator import estimate_tokens
-from project_compression.openai_utils import compress_string
+from project_compression.token_estimator import count_tokens
+from project_compression.openai_utils import COMPRESSION_PROMPT, compress_string
+from project_compression.file_utils import compile_ignore_patterns, compile_ignored_extensions
 
 def get_folder_structure(folder_path, ignored_folders=[], ignored_files=[], ignored_extensions=[], prefix=''):
     """
@@ -8,29 +9,44 @@ def get_folder_structure(folder_path, ignored_folders=[], ignored_files=[], igno
 
     Args:
     - folder_path: A string representing the path to the directory.
-    - ignored_folders: A list of folder names to ignore.
-    - ignored_files: A list of file names to ignore.
-    - ignored_extensions: A list of file extensions to ignore.
+    - ignored_folders: A list of folder names or glob patterns to ignore.
+    - ignored_files: A list of file names or glob patterns to ignore.
+    - ignored_extensions: A list of file extensions to ignore (case-insensitive).
     - prefix: A string representing the prefix to add to the folder structure text.
 
     Returns:
     A string representing the text of the directory structure.
     """
 
-    folder_structure = f'{prefix}{os.path.basename(folder_path)}/\n'
-    prefix += '|   '
-    for item in os.listdir(folder_path):
-        item_path = os.path.join(folder_path, item)
-        if os.path.isfile(item_path):
-            if item.endswith(tuple(ignored_extensions)) or item in ignored_files:
+    is_ignored_folder = compile_ignore_patterns(tuple(ignored_folders))
+    is_ignored_file = compile_ignore_patterns(tuple(ignored_files))
+    has_ignored_extension = compile_ignored_extensions(tuple(ignored_extensions))
+    parts = [f'{prefix}{os.path.basename(folder_path)}/\n']
+
+    # depth-first walk with an explicit stack of (pending entries, prefix) instead of recursion.
+    # entries are sorted so the output, and therefore its cache key, is stable between runs
+    stack = [(iter(_scan_sorted(folder_path)), prefix + '|   ')]
+    while stack:
+        entries, prefix = stack[-1]
+        entry = next(entries, None)
+        if entry is None:
+            stack.pop()
+            continue
+        if entry.is_file():
+            if has_ignored_extension(entry.name) or is_ignored_file(entry.name):
                 continue
-            folder_structure += f'{prefix}|-- {item}\n'
-        elif os.path.isdir(item_path):
-            if item in ignored_folders:
+            parts.append(f'{prefix}|-- {entry.name}\n')
+        elif entry.is_dir(follow_symlinks=False):
+            if is_ignored_folder(entry.name):
                 continue
-            folder_structure += get_folder_structure(item_path, ignored_folders=ignored_folders, ignored_files=ignored_files, ignored_extensions=ignored_extensions, prefix=prefix)
-            
-    return folder_structure
+            parts.append(f'{prefix}{entry.name}/\n')
+            stack.append((iter(_scan_sorted(entry.path)), prefix + '|   '))
+
+    return ''.join(parts)
+
+def _scan_sorted(folder_path):
+    with os.scandir(folder_path) as it:
+        return sorted(it, key=lambda entry: entry.name)
 
 
 def add_prefix_prompt(prompt_template, prefix, suffix):
@@ -57,29 +73,32 @@ def compress_data_with_chunking(compressed_data, model, temperature, max_content
     - compressed_data: str, the data to compress
     - model: str, the name of the OpenAI language model to use for compression
     - temperature: float, the temperature setting to use for the language model
-    - max_content_tokens: int, the maximum number of tokens allowed for the compressed data
+    - max_content_tokens: int, the maximum number of tokens allowed per request, including the compression prompt
 
     Returns:
     - str, the compressed data
     """
-    # estimate the number of tokens for the compressed data
-    num_tokens = estimate_tokens(compressed_data)
-
-    # if the number of tokens exceeds the maximum allowed, split the compressed data into chunks and compress each chunk separately
-    if num_tokens > max_content_tokens:
-        compressed_chunks = []
-        current_chunk = ''
-        for line in compressed_data.split('\n'):
-            line_tokens = estimate_tokens(line)
-            if len(current_chunk) + line_tokens > max_content_tokens:
-                compressed_chunks.append(compress_string(current_chunk, model, temperature))
-                current_chunk = line
-            else:
-                current_chunk += '\n' + line
-        if current_chunk:
-            compressed_chunks.append(compress_string(current_chunk, model, temperature))
-        compressed_data = '\n'.join(compressed_chunks)
-    else:
-        compressed_data = compress_string(compressed_data, model, temperature)
-
-    return compressed_data
\ No newline at end of file
+    # the compression prompt is sent along with every chunk, so it counts against the budget
+    budget = max(max_content_tokens - count_tokens(COMPRESSION_PROMPT, model), 1)
+
+    lines = compressed_data.split('\n')
+    # one extra token per line for the newline separating it from the previous one
+    line_tokens = [count_tokens(line, model) + 1 for line in lines]
+
+    if sum(line_tokens) <= budget:
+        return compress_string(compressed_data, model, temperature)
+
+    # greedily pack as many lines as fit into each chunk, and compress each chunk separately
+    chunks = []
+    current_lines = []
+    current_tokens = 0
+    for line, tokens in zip(lines, line_tokens):
+        if current_lines and current_tokens + tokens > budget:
+            chunks.append('\n'.join(current_lines))
+            current_lines = []
+            current_tokens = 0
+        current_lines.append(line)
+        current_tokens += tokens
+    chunks.append('\n'.join(current_lines))
+
+    return '\n'.join(compress_string(chunk, model, temperature) for chunk in chunks)
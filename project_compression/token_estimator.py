@@ -1,3 +1,10 @@
+import functools
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
 def estimate_tokens(text, method="max"):
     """
     Estimates the number of tokens in a given text using different methods.
@@ -30,3 +37,29 @@ def estimate_tokens(text, method="max"):
         return "Invalid method. Use 'average', 'words', 'chars', 'max', or 'min'."
 
     return int(output)
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model):
+    """
+    Returns the tiktoken encoding used by a given model, or cl100k_base if the model is unknown to tiktoken.
+    """
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+def count_tokens(text, model):
+    """
+    Counts the number of tokens in a given text as tokenized by a given model.
+
+    Args:
+    - text: A string representing the text to be tokenized.
+    - model: A string representing the name of the OpenAI language model.
+
+    Returns:
+    An integer representing the number of tokens in the input text. If tiktoken is not installed, the result of estimate_tokens is returned instead.
+    """
+    if tiktoken is None:
+        return estimate_tokens(text)
+
+    return len(get_encoding(model).encode(text, disallowed_special=()))
@@ -0,0 +1,87 @@
+import unittest
+import os
+import tempfile
+from unittest.mock import MagicMock
+from project_compression.cache_utils import FileManifest, disk_cache, cache_key, read_cache, write_cache
+
+class TestCacheUtils(unittest.TestCase):
+
+    def test_disk_cache(self):
+        mock_compress = MagicMock(return_value="Ths smp txt.")
+        compress = disk_cache('request-1')(mock_compress)
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            first = compress("This is a sample text.", 'gpt-3.5-turbo', 0.4, "https://api.openai.com/v1", cache_dir=cache_dir)
+            second = compress("This is a sample text.", 'gpt-3.5-turbo', 0.4, "https://api.openai.com/v1", cache_dir=cache_dir)
+
+            self.assertEqual(first, second)
+            self.assertEqual(mock_compress.call_count, 1)
+            self.assertEqual(read_cache(cache_key("This is a sample text.", 'gpt-3.5-turbo', 0.4, "https://api.openai.com/v1", 'request-1'), cache_dir), first)
+            # the same model name served by another API is cached separately
+            compress("This is a sample text.", 'gpt-3.5-turbo', 0.4, "http://localhost:8080/v1", cache_dir=cache_dir)
+            self.assertEqual(mock_compress.call_count, 2)
+            # as is the same text sent with another prompt or other token bounds
+            disk_cache('request-2')(mock_compress)("This is a sample text.", 'gpt-3.5-turbo', 0.4, "https://api.openai.com/v1", cache_dir=cache_dir)
+            self.assertEqual(mock_compress.call_count, 3)
+
+    def test_disk_cache_disabled(self):
+        mock_compress = MagicMock(return_value="Ths smp txt.")
+        compress = disk_cache('request-1')(mock_compress)
+
+        compress("This is a sample text.", 'gpt-3.5-turbo', 0.4, "https://api.openai.com/v1")
+        compress("This is a sample text.", 'gpt-3.5-turbo', 0.4, "https://api.openai.com/v1")
+
+        self.assertEqual(mock_compress.call_count, 2)
+
+    def test_file_manifest(self):
+        settings = {'request': 'request-1', 'base_url': "https://api.openai.com/v1", 'model': 'gpt-3.5-turbo', 'temperature': 0.0, 'max_content_tokens': 4000, 'max_file_bytes': 524288}
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            file_path = os.path.join(cache_dir, 'file1.py')
+            with open(file_path, 'w') as f:
+                f.write('print("hello world")')
+            file_stat = os.stat(file_path)
+
+            key = cache_key('print("hello world")', 'gpt-3.5-turbo', 0.0, "https://api.openai.com/v1", 'request-1')
+            write_cache(key, "Ths smp txt.", cache_dir)
+            manifest = FileManifest(cache_dir, cache_dir)
+            manifest.record(file_path, file_stat, settings, key, 5)
+            manifest.save()
+
+            manifest = FileManifest(cache_dir, cache_dir)
+            self.assertEqual(manifest.lookup(file_path, file_stat, settings), ("Ths smp txt.", 5))
+            # e.g. a file replaced by the too-large placeholder under a lower limit must be compressed again
+            self.assertIsNone(manifest.lookup(file_path, file_stat, dict(settings, max_content_tokens=100)))
+            self.assertIsNone(manifest.lookup(file_path, file_stat, dict(settings, base_url="http://localhost:8080/v1")))
+
+    def test_file_manifest_keeps_only_visited_files(self):
+        settings = {'model': 'gpt-3.5-turbo'}
+
+        with tempfile.TemporaryDirectory() as project_dir, tempfile.TemporaryDirectory() as cache_dir:
+            file_stats = {}
+            for name in ('kept.py', 'deleted.py'):
+                file_path = os.path.join(project_dir, name)
+                with open(file_path, 'w') as f:
+                    f.write(name)
+                file_stats[file_path] = os.stat(file_path)
+                write_cache(name, f"compressed {name}", cache_dir)
+            kept_path, deleted_path = file_stats
+
+            manifest = FileManifest(cache_dir, project_dir)
+            for file_path, file_stat in file_stats.items():
+                manifest.record(file_path, file_stat, settings, os.path.basename(file_path), 1)
+            manifest.save()
+
+            # deleted.py is not visited by the next run, so it is dropped from the manifest
+            manifest = FileManifest(cache_dir, project_dir)
+            self.assertEqual(manifest.lookup(kept_path, file_stats[kept_path], settings), ("compressed kept.py", 1))
+            manifest.save()
+
+            manifest = FileManifest(cache_dir, project_dir)
+            self.assertEqual(list(manifest.previous_entries), [os.path.abspath(kept_path)])
+            self.assertIsNone(manifest.lookup(deleted_path, file_stats[deleted_path], settings))
+            # other projects have a manifest of their own
+            self.assertEqual(FileManifest(cache_dir, os.path.join(project_dir, 'other')).previous_entries, {})
+
+if __name__ == '__main__':
+    unittest.main()
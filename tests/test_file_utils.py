@@ -0,0 +1,101 @@
+import unittest
+import tempfile
+from unittest import mock
+from project_compression.file_utils import SNIFF_BYTES, compile_ignore_patterns, compile_ignored_extensions, is_binary, read_text_file, walk_project_files
+from project_compression.prompt_utils import get_folder_structure
+import os
+
+# Get the absolute path of the current file
+current_file_path = os.path.abspath(__file__)
+
+# Get the path of the "tests" folder
+tests_folder_path = os.path.dirname(current_file_path)
+
+class TestFileUtils(unittest.TestCase):
+
+    def test_walk_project_files(self):
+        file_names = [entry.name for entry in walk_project_files(tests_folder_path, ignored_folders=['__pycache__'], ignored_files=['__init__.py'], ignored_extensions=['.PY'])]
+
+        self.assertEqual(file_names, [])
+
+    def test_walk_project_files_prunes_ignored_folders(self):
+        file_paths = [entry.path for entry in walk_project_files(tests_folder_path, ignored_folders=['test_data', '__pycache__'])]
+
+        self.assertIn(os.path.join(tests_folder_path, 'test_file_utils.py'), file_paths)
+        self.assertFalse(any('test_data' in file_path for file_path in file_paths))
+
+    def test_walk_project_files_does_not_follow_folder_symlinks(self):
+        with tempfile.TemporaryDirectory() as project_dir:
+            os.mkdir(os.path.join(project_dir, 'sub'))
+            with open(os.path.join(project_dir, 'sub', 'a.py'), 'w') as f:
+                f.write('print("a")')
+            os.symlink('..', os.path.join(project_dir, 'sub', 'loop'))
+
+            file_paths = [entry.path for entry in walk_project_files(project_dir)]
+            folder_structure = get_folder_structure(project_dir)
+
+        self.assertEqual(file_paths, [os.path.join(project_dir, 'sub', 'a.py')])
+        self.assertNotIn('loop', folder_structure)
+
+    def test_compile_ignore_patterns(self):
+        is_ignored = compile_ignore_patterns(('.git', '*.egg-info', 'test_*.py'))
+
+        self.assertTrue(is_ignored('.git'))
+        self.assertTrue(is_ignored('projectalyzer.egg-info'))
+        self.assertTrue(is_ignored('test_file_utils.py'))
+        self.assertFalse(is_ignored('.gitignore'))
+        self.assertFalse(is_ignored('file_utils.py'))
+        self.assertFalse(compile_ignore_patterns(())('.git'))
+
+    def test_compile_ignored_extensions(self):
+        has_ignored_extension = compile_ignored_extensions(('.PNG', '.tar.gz'))
+
+        self.assertTrue(has_ignored_extension('logo.png'))
+        self.assertTrue(has_ignored_extension('release.TAR.GZ'))
+        self.assertFalse(has_ignored_extension('archive.gz'))
+        self.assertFalse(has_ignored_extension('png.py'))
+        self.assertFalse(compile_ignored_extensions(())('logo.png'))
+
+    def test_walk_and_folder_structure_ignore_the_same_extensions(self):
+        with tempfile.TemporaryDirectory() as project_dir:
+            for name in ('a.py', 'b.PNG', 'c.tar.gz'):
+                with open(os.path.join(project_dir, name), 'w') as f:
+                    f.write('x')
+
+            file_names = [entry.name for entry in walk_project_files(project_dir, ignored_extensions=['.png', '.tar.gz'])]
+            folder_structure = get_folder_structure(project_dir, ignored_extensions=['.png', '.tar.gz'])
+
+        self.assertEqual(file_names, ['a.py'])
+        self.assertIn('a.py', folder_structure)
+        self.assertNotIn('b.PNG', folder_structure)
+        self.assertNotIn('c.tar.gz', folder_structure)
+
+    def test_is_binary(self):
+        self.assertFalse(is_binary('print("hello world")\n'.encode('utf-8')))
+        self.assertFalse(is_binary('print("héllo")'.encode('utf-8')[:9]))
+        self.assertTrue(is_binary(b'\x7fELF\x02\x01\x01\x00\x00'))
+        self.assertTrue(is_binary(b'\xff\xd8\xff\xe0'))
+
+    def test_read_text_file(self):
+        with tempfile.TemporaryDirectory() as project_dir:
+            text_path = os.path.join(project_dir, 'large.py')
+            with open(text_path, 'w', encoding='utf-8') as f:
+                f.write('print("héllo")\n' * SNIFF_BYTES)
+            # invalid UTF-8 after the sniffed start is still rejected
+            broken_path = os.path.join(project_dir, 'broken.py')
+            with open(broken_path, 'wb') as f:
+                f.write(b'x' * SNIFF_BYTES + b'\xff')
+
+            self.assertEqual(read_text_file(text_path), 'print("héllo")\n' * SNIFF_BYTES)
+            self.assertIsNone(read_text_file(broken_path))
+
+    def test_read_text_file_skips_the_rest_of_binaries(self):
+        mock_open = mock.mock_open(read_data=b'\x00' * (4 * SNIFF_BYTES))
+
+        with mock.patch('project_compression.file_utils.open', mock_open, create=True):
+            self.assertIsNone(read_text_file('image.bin'))
+
+        self.assertEqual(mock_open.return_value.read.call_args_list, [mock.call(SNIFF_BYTES)])
+
+if __name__ == '__main__':
+    unittest.main()
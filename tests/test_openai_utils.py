@@ -1,23 +1,147 @@
 import unittest
-from unittest.mock import patch
-from project_compression.openai_utils import compress_string
+from unittest.mock import MagicMock, patch
+from project_compression.openai_utils import DEFAULT_BASE_URL, MAX_MAX_TOKENS, MAX_RETRIES, MIN_MAX_TOKENS, build_compression_request, compress_string, compress_strings_batch, resolve_base_url
+import json
+import openai
+import tempfile
 import os
 
+def batch_output_line(custom_id, content=None, finish_reason='stop'):
+    # a line of a batch output file, failed if no content is given
+    if content is None:
+        return json.dumps({"custom_id": custom_id, "response": None, "error": {"code": "server_error"}})
+    return json.dumps({"custom_id": custom_id, "response": {"status_code": 200, "body": {"choices": [{"message": {"content": content}, "finish_reason": finish_reason}]}}, "error": None})
+
+def mock_batch_client(output_lines, status='completed'):
+    mock_client = MagicMock()
+    mock_client.batches.create.return_value = MagicMock(id="batch_1", status="in_progress")
+    mock_client.batches.retrieve.return_value = MagicMock(id="batch_1", status=status, output_file_id="file_out" if output_lines else None)
+    mock_client.files.content.return_value.text = "\n".join(output_lines) + "\n"
+    return mock_client
+
+def api_error(error_class):
+    # the SDK's errors require an httpx response, which the retry logic never looks at
+    return error_class.__new__(error_class)
+
 class TestOpenAIUtils(unittest.TestCase):
 
-    @patch("project_compression.openai_utils.openai.Completion.create")
-    def test_compress_string(self, mock_completion_create):
+    def test_compress_string(self):
         # Mock the response from the OpenAI API
-        mock_completion_create.return_value.choices = [{"text": "Ths smp txt."}]
-
+        mock_client = MagicMock()
+        mock_client.chat.completions.create.return_value.choices = [MagicMock(message=MagicMock(content="Ths smp txt."))]
 
         text = "This is a sample text."
         model = 'gpt-3.5-turbo'
         temperature = 0.4
-        compressed_text = compress_string(text, model, temperature)
+        compressed_text = compress_string(text, model, temperature, client=mock_client)
 
         self.assertNotEqual(compressed_text, text)
         self.assertTrue(len(compressed_text) > 0)
 
+    def test_resolve_base_url(self):
+        with patch.dict(os.environ, {"OPENAI_BASE_URL": "http://localhost:8080/v1/"}):
+            self.assertEqual(resolve_base_url(), "http://localhost:8080/v1")
+            self.assertEqual(resolve_base_url("http://localhost:8000/v1"), "http://localhost:8000/v1")
+            # a given client's base URL wins, as the requests are sent there
+            self.assertEqual(resolve_base_url("http://localhost:8000/v1", MagicMock(base_url="https://api.openai.com/v1/")), DEFAULT_BASE_URL)
+        with patch.dict(os.environ):
+            os.environ.pop("OPENAI_BASE_URL", None)
+            self.assertEqual(resolve_base_url(), DEFAULT_BASE_URL)
+
+    def test_compress_string_caches_per_base_url(self):
+        mock_client = MagicMock()
+        mock_client.chat.completions.create.return_value.choices = [MagicMock(message=MagicMock(content="Ths smp txt."))]
+
+        with tempfile.TemporaryDirectory() as cache_dir, patch("project_compression.openai_utils.get_client", return_value=mock_client):
+            for base_url in ("https://api.openai.com/v1", "http://localhost:8080/v1", "http://localhost:8080/v1"):
+                compress_string("This is a sample text.", 'gpt-3.5-turbo', 0.0, base_url=base_url, cache_dir=cache_dir)
+
+        self.assertEqual(mock_client.chat.completions.create.call_count, 2)
+
+    @patch("project_compression.openai_utils.count_tokens", side_effect=lambda text, model: len(text))
+    def test_build_compression_request_bounds_max_tokens(self, mock_count_tokens):
+        self.assertEqual(build_compression_request("x" * 10, 'gpt-3.5-turbo', 0.0)['max_tokens'], MIN_MAX_TOKENS)
+        self.assertEqual(build_compression_request("x" * 1000, 'gpt-3.5-turbo', 0.0)['max_tokens'], 2000)
+        self.assertEqual(build_compression_request("x" * 100000, 'gpt-3.5-turbo', 0.0)['max_tokens'], MAX_MAX_TOKENS)
+
+    def test_compress_string_rejects_truncated_output(self):
+        mock_client = MagicMock()
+        mock_client.chat.completions.create.return_value.choices = [MagicMock(message=MagicMock(content="Ths smp"), finish_reason='length')]
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with self.assertRaises(ValueError):
+                compress_string("This is a sample text.", 'gpt-3.5-turbo', 0.0, client=mock_client, cache_dir=cache_dir)
+
+            # the cut off output was not cached
+            self.assertEqual(os.listdir(cache_dir), [])
+
+    @patch("project_compression.openai_utils.time.sleep")
+    def test_compress_string_retries_rate_limits(self, mock_sleep):
+        response = MagicMock()
+        response.choices = [MagicMock(message=MagicMock(content="Ths smp txt."))]
+        mock_client = MagicMock()
+        mock_client.chat.completions.create.side_effect = [api_error(openai.RateLimitError), response]
+
+        compressed_text = compress_string("This is a sample text.", 'gpt-3.5-turbo', 0.0, client=mock_client)
+
+        self.assertEqual(compressed_text, "Ths smp txt.")
+        self.assertEqual(mock_client.chat.completions.create.call_count, 2)
+        mock_sleep.assert_called_once()
+
+    @patch("project_compression.openai_utils.time.sleep")
+    def test_compress_string_gives_up_after_max_retries(self, mock_sleep):
+        mock_client = MagicMock()
+        mock_client.chat.completions.create.side_effect = api_error(openai.APIConnectionError)
+
+        with self.assertRaises(openai.APIConnectionError):
+            compress_string("This is a sample text.", 'gpt-3.5-turbo', 0.0, client=mock_client)
+
+        self.assertEqual(mock_client.chat.completions.create.call_count, MAX_RETRIES)
+        self.assertEqual(mock_sleep.call_count, MAX_RETRIES - 1)
+
+    @patch("project_compression.openai_utils.time.sleep")
+    def test_compress_string_does_not_retry_other_errors(self, mock_sleep):
+        mock_client = MagicMock()
+        mock_client.chat.completions.create.side_effect = api_error(openai.BadRequestError)
+
+        with self.assertRaises(openai.BadRequestError):
+            compress_string("This is a sample text.", 'gpt-3.5-turbo', 0.0, client=mock_client)
+
+        self.assertEqual(mock_client.chat.completions.create.call_count, 1)
+        mock_sleep.assert_not_called()
+
+    @patch("project_compression.openai_utils.time.sleep")
+    def test_compress_strings_batch(self, mock_sleep):
+        mock_client = mock_batch_client([batch_output_line("file1.py", "Ths smp txt."), batch_output_line("file2.py"), batch_output_line("file3.py", "Ths", finish_reason='length')])
+
+        texts = {"file1.py": "This is a sample text.", "file2.py": "This is another sample text.", "file3.py": "This is a third sample text."}
+        compressed_texts = compress_strings_batch(texts, 'gpt-3.5-turbo', 0.0, client=mock_client)
+
+        # one request per text, identified by its custom_id
+        upload = mock_client.files.create.call_args.kwargs['file'][1].decode('utf-8')
+        requests = [json.loads(line) for line in upload.splitlines()]
+        self.assertEqual([request['custom_id'] for request in requests], ["file1.py", "file2.py", "file3.py"])
+        self.assertEqual(requests[0]['body']['messages'][-1]['content'], "This is a sample text.")
+
+        # the failed request is left out and the cut off one has no compressed text
+        self.assertEqual(compressed_texts, {"file1.py": "Ths smp txt.", "file3.py": None})
+        mock_sleep.assert_called_once()
+
+    @patch("project_compression.openai_utils.time.sleep")
+    def test_compress_strings_batch_without_output(self, mock_sleep):
+        mock_client = mock_batch_client([], status='failed')
+
+        compressed_texts = compress_strings_batch({"file1.py": "This is a sample text."}, 'gpt-3.5-turbo', 0.0, client=mock_client)
+
+        self.assertEqual(compressed_texts, {})
+
+    def test_compress_strings_batch_empty(self):
+        mock_client = MagicMock()
+
+        compressed_texts = compress_strings_batch({}, 'gpt-3.5-turbo', 0.0, client=mock_client)
+
+        self.assertEqual(compressed_texts, {})
+        mock_client.files.create.assert_not_called()
+
 if __name__ == '__main__':
     unittest.main()
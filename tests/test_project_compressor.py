@@ -1,7 +1,13 @@
 import unittest
-from unittest.mock import patch
-from project_compression.project_compression import ProjectCompressor
+from unittest.mock import MagicMock, patch
+from project_compression.project_compression import COMPRESSION_TRUNCATED_CONTENT, FILE_TOO_LARGE_CONTENT, ProjectCompressor
+from project_compression.file_utils import read_text_file
+from tests.test_openai_utils import batch_output_line, mock_batch_client
+import json
 import os
+import tempfile
+import threading
+import time
 
 # Get the absolute path of the current file
 current_file_path = os.path.abspath(__file__)
@@ -15,8 +21,34 @@ test_data_folder_path = os.path.join(tests_folder_path, 'test_data')
 # Get the path of the "test_project" folder
 test_project_folder_path = os.path.join(test_data_folder_path, 'test_project')
 
+def write_project(project_dir, files):
+    for name, content in files.items():
+        with open(os.path.join(project_dir, name), 'wb') as f:
+            f.write(content.encode('utf-8') if isinstance(content, str) else content)
+
+def fake_compress_string(text, model, temperature, *args, **kwargs):
+    return f"<{text}>"
+
 class TestProjectCompressor(unittest.TestCase):
 
+    def run_with_timeout(self, func, timeout=10):
+        # runs func in a daemon thread, so a deadlock fails the test instead of hanging the suite
+        outcome = {}
+
+        def target():
+            try:
+                outcome['result'] = func()
+            except BaseException as e:
+                outcome['error'] = e
+
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        thread.join(timeout)
+        self.assertFalse(thread.is_alive(), "compress_project did not finish")
+        if 'error' in outcome:
+            raise outcome['error']
+        return outcome['result']
+
     @patch("project_compression.project_compression.compress_string")
     def test_compress_project(self, mock_compress_string):
         # Mock the compress_string function
@@ -28,5 +60,173 @@ class TestProjectCompressor(unittest.TestCase):
 
         self.assertNotEqual(compressed_data, {})
 
+    @patch("project_compression.project_compression.compress_string", side_effect=fake_compress_string)
+    def test_compress_project_deduplicates_files(self, mock_compress_string):
+        with tempfile.TemporaryDirectory() as project_dir:
+            write_project(project_dir, {'a.py': 'print("a")', 'b.py': 'print("a")', 'c.py': 'print("c")'})
+
+            chunks = ProjectCompressor().compress_project(project_dir)
+
+        # the folder structure and the two distinct file contents
+        self.assertEqual(mock_compress_string.call_count, 3)
+        self.assertIn(f'{os.path.join(project_dir, "a.py")} with an estimated decompressed token length of', chunks[0])
+        self.assertEqual(chunks[0].count('<print("a")>'), 2)
+
+    @patch("project_compression.project_compression.compress_string")
+    def test_compress_project_keeps_walk_order(self, mock_compress_string):
+        def slow_first_file(text, *args, **kwargs):
+            # the first file finishes last
+            if text == 'print("a")':
+                time.sleep(0.1)
+            return fake_compress_string(text, *args, **kwargs)
+
+        mock_compress_string.side_effect = slow_first_file
+        with tempfile.TemporaryDirectory() as project_dir:
+            write_project(project_dir, {'a.py': 'print("a")', 'b.py': 'print("b")', 'c.py': 'print("c")'})
+
+            chunks = ProjectCompressor().compress_project(project_dir)
+
+        positions = [chunks[0].index(f'<print("{name}")>') for name in 'abc']
+        self.assertEqual(positions, sorted(positions))
+
+    @patch("project_compression.project_compression.compress_string", side_effect=fake_compress_string)
+    def test_compress_project_releases_skipped_files(self, mock_compress_string):
+        # with a single pending file, a binary or too large file that did not give back its slot would block the walk
+        with tempfile.TemporaryDirectory() as project_dir:
+            write_project(project_dir, {'a.bin': b'\x00\x01\x02', 'b.py': 'x' * 100, 'c.py': 'print("c")'})
+            compressor = ProjectCompressor(max_pending_files=1, io_workers=1, max_file_bytes=50)
+
+            chunks = self.run_with_timeout(lambda: compressor.compress_project(project_dir))
+
+        self.assertNotIn('a.bin with', chunks[0])
+        self.assertIn(f'<{FILE_TOO_LARGE_CONTENT}>', chunks[0])
+        self.assertIn('<print("c")>', chunks[0])
+
+    @patch("project_compression.project_compression.compress_string", side_effect=fake_compress_string)
+    def test_compress_project_releases_failed_reads(self, mock_compress_string):
+        def fail_first_file(file_path):
+            if file_path.endswith('a.py'):
+                raise PermissionError(file_path)
+            return read_text_file(file_path)
+
+        with tempfile.TemporaryDirectory() as project_dir, patch("project_compression.project_compression.read_text_file", side_effect=fail_first_file):
+            write_project(project_dir, {'a.py': 'print("a")', 'b.py': 'print("b")', 'c.py': 'print("c")'})
+            compressor = ProjectCompressor(max_pending_files=1, io_workers=1)
+
+            with self.assertRaises(PermissionError):
+                self.run_with_timeout(lambda: compressor.compress_project(project_dir))
+
+    def test_compress_project_keeps_going_after_truncated_compressions(self):
+        def create(messages, **kwargs):
+            text = messages[-1]['content']
+            finish_reason = 'length' if text == 'print("a")' else 'stop'
+            return MagicMock(choices=[MagicMock(message=MagicMock(content=f"<{text}>"), finish_reason=finish_reason)])
+
+        mock_client = MagicMock()
+        mock_client.chat.completions.create.side_effect = create
+
+        with tempfile.TemporaryDirectory() as project_dir, tempfile.TemporaryDirectory() as cache_dir:
+            write_project(project_dir, {'a.py': 'print("a")', 'b.py': 'print("b")'})
+
+            with self.assertLogs('project_compression.project_compression', level='WARNING') as logs:
+                chunks = ProjectCompressor(client=mock_client, cache_dir=cache_dir).compress_project(project_dir)
+
+            self.assertIn(COMPRESSION_TRUNCATED_CONTENT, chunks[0])
+            self.assertIn('<print("b")>', chunks[0])
+            self.assertTrue(any('a.py' in line for line in logs.output))
+
+            # the placeholder was not cached, so the truncated file is sent again while b.py comes from the cache
+            mock_client.chat.completions.create.reset_mock()
+            ProjectCompressor(client=mock_client, cache_dir=cache_dir).compress_project(project_dir)
+            sent_texts = [call.kwargs['messages'][-1]['content'] for call in mock_client.chat.completions.create.call_args_list]
+            self.assertEqual(sent_texts, ['print("a")'])
+
+    @patch("project_compression.project_compression.compress_string")
+    def test_compress_texts_parallel_deduplicates(self, mock_compress_string):
+        mock_compress_string.return_value = "Compressed content"
+
+        compressor = ProjectCompressor()
+        compressed_results = compressor.compress_texts_parallel({'a/__init__.py': '', 'b/__init__.py': '', 'file.py': 'print("hello world")'})
+
+        self.assertEqual(mock_compress_string.call_count, 2)
+        self.assertEqual(set(compressed_results), {'a/__init__.py', 'b/__init__.py', 'file.py'})
+
+    @patch("project_compression.project_compression.count_tokens")
+    def test_build_chunks(self, mock_count_tokens):
+        # one token per character keeps the chunk boundaries easy to follow
+        mock_count_tokens.side_effect = lambda text, model: len(text)
+
+        compressor = ProjectCompressor(max_content_tokens=250, prefix="P", suffix="S")
+        compressed_files = [('a.py', 1, "A" * 50), ('b.py', 1, "B" * 50), ('c.py', 1, "C" * 50)]
+        chunks = compressor.build_chunks("F", compressed_files)
+
+        # the header takes 70 tokens and each line about 130, so every file needs its own chunk
+        self.assertEqual(len(chunks), 3)
+        for i, (file_path, _, comp_content) in enumerate(compressed_files):
+            self.assertTrue(chunks[i].startswith(f"THIS IS PART {i} OF 3.\n"))
+            self.assertTrue(chunks[i].endswith("S"))
+            # every file appears exactly once over all chunks, in the chunk it was placed in
+            self.assertEqual(chunks[i].count("This is the compressed content of"), 1)
+            self.assertEqual(sum(chunk.count(comp_content) for chunk in chunks), 1)
+            self.assertIn(comp_content, chunks[i])
+            self.assertLessEqual(len(chunks[i]) - len(f"THIS IS PART {i} OF 3.\n"), 250)
+
+    @patch("project_compression.project_compression.count_tokens")
+    def test_build_chunks_single_chunk(self, mock_count_tokens):
+        mock_count_tokens.side_effect = lambda text, model: len(text)
+
+        compressor = ProjectCompressor(max_content_tokens=4000, prefix="P", suffix="S")
+        chunks = compressor.build_chunks("F", [('a.py', 1, "A"), ('b.py', 1, "B")])
+
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(chunks[0].count("This is the compressed content of a.py"), 1)
+        self.assertEqual(chunks[0].count("This is the compressed content of b.py"), 1)
+
+    def test_compress_project_cache_respects_limits(self):
+        mock_client = MagicMock()
+        mock_client.chat.completions.create.return_value.choices = [MagicMock(message=MagicMock(content="Compressed content"))]
+
+        with tempfile.TemporaryDirectory() as project_dir, tempfile.TemporaryDirectory() as cache_dir:
+            with open(os.path.join(project_dir, 'large.py'), 'w') as f:
+                f.write('x = 1\n' * 400)
+
+            def sent_texts():
+                return [call.kwargs['messages'][-1]['content'] for call in mock_client.chat.completions.create.call_args_list]
+
+            ProjectCompressor(max_content_tokens=100, client=mock_client, cache_dir=cache_dir).compress_project(project_dir)
+            self.assertTrue(any(text.startswith("COMPRESSION OUTPUT: FILE TOO LARGE") for text in sent_texts()))
+
+            # with a higher limit the placeholder cached by the first run must not be reused
+            mock_client.chat.completions.create.reset_mock()
+            ProjectCompressor(max_content_tokens=4000, client=mock_client, cache_dir=cache_dir).compress_project(project_dir)
+            self.assertIn('x = 1\n' * 400, sent_texts())
+
+    @patch("project_compression.project_compression.read_text_file")
+    def test_read_project_file_skips_files_over_max_file_bytes(self, mock_read_text_file):
+        compressor = ProjectCompressor(max_file_bytes=1000)
+
+        result = compressor.read_project_file('huge.json', MagicMock(st_size=4000))
+
+        self.assertEqual(result, (FILE_TOO_LARGE_CONTENT, 1000))
+        mock_read_text_file.assert_not_called()
+
+    @patch("project_compression.openai_utils.time.sleep")
+    def test_compress_texts_batch(self, mock_sleep):
+        # a.py and b.py share their text, c.py fails inside the batch and d.py is cut off
+        mock_client = mock_batch_client([batch_output_line("a.py", "Compressed a"), batch_output_line("c.py"), batch_output_line("d.py", "Compr", finish_reason='length')])
+        mock_client.chat.completions.create.return_value.choices = [MagicMock(message=MagicMock(content="Compressed c"))]
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            compressor = ProjectCompressor(batch=True, client=mock_client, cache_dir=cache_dir)
+            compressed_results = compressor.compress_texts_batch({'a.py': 'print("a")', 'b.py': 'print("a")', 'c.py': 'print("c")', 'd.py': 'print("d")'})
+            cached_files = len(os.listdir(cache_dir))
+
+        upload = mock_client.files.create.call_args.kwargs['file'][1].decode('utf-8')
+        self.assertEqual([json.loads(line)['custom_id'] for line in upload.splitlines()], ['a.py', 'c.py', 'd.py'])
+        self.assertEqual(compressed_results, {'a.py': "Compressed a", 'b.py': "Compressed a", 'c.py': "Compressed c", 'd.py': COMPRESSION_TRUNCATED_CONTENT})
+        # only the failed request is retried, and the cut off one is not cached
+        self.assertEqual(mock_client.chat.completions.create.call_count, 1)
+        self.assertEqual(cached_files, 2)
+
 if __name__ == '__main__':
     unittest.main()
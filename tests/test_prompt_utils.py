@@ -1,4 +1,6 @@
 import unittest
+from unittest import mock
+from project_compression.openai_utils import COMPRESSION_PROMPT
 from project_compression.prompt_utils import get_folder_structure, compress_data_with_chunking
 import os
 
@@ -33,5 +35,39 @@ class TestPromptUtils(unittest.TestCase):
 
         self.assertIsNotNone(compressed_result)
 
+    def count_words(self, text, model):
+        return len(text.split())
+
+    def compress_chunks(self, data, max_content_tokens):
+        with mock.patch('project_compression.prompt_utils.count_tokens', side_effect=self.count_words), \
+                mock.patch('project_compression.prompt_utils.compress_string', side_effect=lambda text, model, temperature: f"<{text}>") as compress_string:
+            result = compress_data_with_chunking(data, "gpt-3.5-turbo", 0.0, max_content_tokens)
+        return result, [call.args[0] for call in compress_string.call_args_list]
+
+    def test_compress_data_with_chunking_packs_lines_greedily(self):
+        # the budget left after the prompt is 6 tokens, and every line costs its words plus one for the newline
+        max_content_tokens = len(COMPRESSION_PROMPT.split()) + 6
+
+        result, chunks = self.compress_chunks("a b\nc d\ne f g h\ni", max_content_tokens)
+
+        self.assertEqual(chunks, ["a b\nc d", "e f g h", "i"])
+        self.assertEqual(result, "<a b\nc d>\n<e f g h>\n<i>")
+
+    def test_compress_data_with_chunking_single_request(self):
+        max_content_tokens = len(COMPRESSION_PROMPT.split()) + 6
+
+        result, chunks = self.compress_chunks("a b\nc d", max_content_tokens)
+
+        self.assertEqual(chunks, ["a b\nc d"])
+        self.assertEqual(result, "<a b\nc d>")
+
+    def test_compress_data_with_chunking_oversized_line(self):
+        # a line over the budget is sent on its own rather than dropped or split
+        max_content_tokens = len(COMPRESSION_PROMPT.split()) + 2
+
+        _, chunks = self.compress_chunks("a\nb c d e\nf", max_content_tokens)
+
+        self.assertEqual(chunks, ["a", "b c d e", "f"])
+
 if __name__ == '__main__':
     unittest.main()
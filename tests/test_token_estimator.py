@@ -1,5 +1,7 @@
 import unittest
-from project_compression.token_estimator import estimate_tokens
+from unittest import mock
+from project_compression import token_estimator
+from project_compression.token_estimator import count_tokens, estimate_tokens
 
 class TestTokenEstimator(unittest.TestCase):
 
@@ -17,5 +19,25 @@ class TestTokenEstimator(unittest.TestCase):
         token_count = estimate_tokens(text)
         self.assertEqual(token_count, expected_token_count)
 
+    def test_count_tokens_without_tiktoken(self):
+        text = "This is a sample text."
+
+        with mock.patch.object(token_estimator, 'tiktoken', None):
+            self.assertEqual(count_tokens(text, "gpt-3.5-turbo"), estimate_tokens(text))
+
+    def test_count_tokens_with_tiktoken(self):
+        fake_tiktoken = mock.Mock()
+        fake_tiktoken.encoding_for_model.return_value.encode.side_effect = lambda text, disallowed_special: text.split()
+
+        token_estimator.get_encoding.cache_clear()
+        self.addCleanup(token_estimator.get_encoding.cache_clear)
+        with mock.patch.object(token_estimator, 'tiktoken', fake_tiktoken):
+            self.assertEqual(count_tokens("This is a sample text.", "gpt-3.5-turbo"), 5)
+            self.assertEqual(count_tokens("<|endoftext|>", "gpt-3.5-turbo"), 1)
+
+        fake_tiktoken.encoding_for_model.assert_called_once_with("gpt-3.5-turbo")
+        # special tokens in project files are counted as plain text instead of raising
+        fake_tiktoken.encoding_for_model.return_value.encode.assert_called_with("<|endoftext|>", disallowed_special=())
+
 if __name__ == '__main__':
     unittest.main()